@@ -0,0 +1,67 @@
+import os, math, time, asyncio
+from typing import AsyncGenerator, Optional
+
+from fastapi import HTTPException, status
+
+# all limits are per process; uvicorn runs WEB_CONCURRENCY workers, so the
+# login default splits the CPUs between them instead of giving each all of them
+WEB_CONCURRENCY         = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+LOGIN_CONCURRENCY       = int(os.getenv("LOGIN_CONCURRENCY", str(max(1, (os.cpu_count() or 2) // WEB_CONCURRENCY))))
+LOGIN_QUEUE_MAX         = int(os.getenv("LOGIN_QUEUE_MAX", str(4 * LOGIN_CONCURRENCY)))
+LOGIN_QUEUE_TIMEOUT_SEC = float(os.getenv("LOGIN_QUEUE_TIMEOUT_SEC", "5"))
+REFRESH_CONCURRENCY     = int(os.getenv("REFRESH_CONCURRENCY", "16"))
+REFRESH_QUEUE_MAX       = int(os.getenv("REFRESH_QUEUE_MAX", "64"))
+REFRESH_QUEUE_TIMEOUT_SEC = float(os.getenv("REFRESH_QUEUE_TIMEOUT_SEC", "2"))
+
+class AdmissionGate:
+    """FastAPI dependency bounding how many requests run and wait for one kind of work.
+
+    Up to `limit` requests run at once and up to `queue_max` wait, each for at
+    most `queue_timeout` seconds. Anything beyond that gets an immediate 503
+    with a Retry-After derived from the queue depth and the observed service
+    time. Waiting happens on the event loop, so shed and queued requests never
+    hold a threadpool worker or a DB connection.
+
+    State lives in the process: with N workers the service as a whole admits
+    up to N * `limit` requests at once.
+    """
+
+    def __init__(self, limit: int, queue_max: int, queue_timeout: float):
+        self.limit = limit
+        self.queue_max = queue_max
+        self.queue_timeout = queue_timeout
+        self.waiting = 0
+        self.avg_sec = 0.25  # EWMA of time spent holding a slot
+        self._sem: Optional[asyncio.Semaphore] = None
+
+    def _busy(self) -> HTTPException:
+        retry = math.ceil((self.waiting + 1) * self.avg_sec / self.limit)
+        return HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Server busy, retry later",
+                             headers={"Retry-After": str(max(1, retry))})
+
+    async def __call__(self) -> AsyncGenerator[None, None]:
+        if self._sem is None:
+            self._sem = asyncio.Semaphore(self.limit)
+        if self._sem.locked():
+            if self.waiting >= self.queue_max:
+                raise self._busy()
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self._sem.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                raise self._busy()
+            finally:
+                self.waiting -= 1
+        else:
+            await self._sem.acquire()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._sem.release()
+            self.avg_sec += 0.2 * (time.perf_counter() - start - self.avg_sec)
+
+# password hashing/verification (bcrypt) is the expensive path
+login_gate   = AdmissionGate(LOGIN_CONCURRENCY, LOGIN_QUEUE_MAX, LOGIN_QUEUE_TIMEOUT_SEC)
+# refresh is cheap but gets its own budget so login load can never shed it
+refresh_gate = AdmissionGate(REFRESH_CONCURRENCY, REFRESH_QUEUE_MAX, REFRESH_QUEUE_TIMEOUT_SEC)
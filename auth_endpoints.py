@@ -1,14 +1,20 @@
-import secrets
+import os, secrets, threading
 from typing import List, Set, Optional, Dict
-from datetime import timedelta
+from datetime import datetime, timedelta, timezone
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from pydantic import BaseModel
+from sqlalchemy import func, text
 from sqlalchemy.orm import Session
 
-from db import get_db, User, Role, RefreshToken, get_password_hash, verify_password, sha256
-from security import create_access_token, now, has_role, decode_and_validate
+from db import get_db, User, Role, RefreshToken, Revocation, get_password_hash, verify_password, sha256
+from atlas_auth.responses import FastJSONResponse
+from admission import login_gate, refresh_gate
+from security import create_access_token, now, role_mask, decode_and_validate, ACCESS_MIN
+
+# shared with the services (their AUTH_REVOCATIONS_TOKEN); unset disables /revocations
+REVOCATIONS_TOKEN = os.getenv("REVOCATIONS_TOKEN", "")
 
 REFRESH_DAYS = 30
 router = APIRouter(tags=["auth"])
@@ -29,7 +35,10 @@ class RefreshBody(BaseModel):
 def _roles(u: User) -> List[str]:
     return [r.name for r in u.roles]
 
-def _issue_pair(u: User, db: Session) -> TokenPair:
+def _role_mask(u: User) -> int:
+    return role_mask(r.id for r in u.roles)
+
+def _issue_pair(u: User, db: Session) -> FastJSONResponse:
     # rotate: invalidate existing refresh tokens for this user
     db.query(RefreshToken).filter(RefreshToken.user_id == u.id).delete(synchronize_session=False)
     rt = secrets.token_urlsafe(32)
@@ -40,10 +49,16 @@ def _issue_pair(u: User, db: Session) -> TokenPair:
         expires_at=now() + timedelta(days=REFRESH_DAYS),
     ))
     db.commit()
-    acc = create_access_token(u.username, _roles(u))
-    return TokenPair(access_token=acc, refresh_token=rt)
-
-def _require_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> User:
+    # a logout earlier in this same second must not revoke the new token
+    cutoff = db.query(func.max(Revocation.issued_before)).filter(
+        Revocation.subject == u.username, Revocation.expires_at > now(),
+    ).scalar()
+    min_iat = int(cutoff.timestamp()) + 1 if cutoff else None
+    acc = create_access_token(u.username, _roles(u), role_mask=_role_mask(u), min_iat=min_iat)
+    # TokenPair shape, rendered without a validation round-trip
+    return FastJSONResponse({"access_token": acc, "refresh_token": rt, "token_type": "bearer"})
+
+def _require_user(request: Request, token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> User:
     try:
         claims = decode_and_validate(token)
         sub = claims.get("sub")
@@ -52,33 +67,51 @@ def _require_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get
     except Exception:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid or expired token")
     u = db.query(User).filter_by(username=sub).one_or_none()
-    if not u:
+    if not u or _is_revoked(db, claims):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid or expired token")
+    request.state.claims = claims
     return u
 
+def _is_revoked(db: Session, claims: Dict) -> bool:
+    iat = datetime.fromtimestamp(claims.get("iat", 0), timezone.utc)
+    return db.query(Revocation.id).filter(
+        Revocation.subject == claims["sub"], Revocation.issued_before >= iat,
+    ).first() is not None
+
 def _require_roles(required: Set[str]):
-    def dep(u: User = Depends(_require_user)) -> User:
-        if not has_role(set(_roles(u)), required):
+    # required names resolve to role-id bits once; role ids never change.
+    # the user's roles come from the DB, not the token, so a revoked role applies at once here
+    pending = set(required)
+    need = 0
+    lock = threading.Lock()
+    def dep(u: User = Depends(_require_user), db: Session = Depends(get_db)) -> User:
+        nonlocal need
+        if pending:
+            with lock:
+                for r in db.query(Role).filter(Role.name.in_(list(pending))).all():
+                    need |= 1 << r.id
+                    pending.discard(r.name)
+        if not _role_mask(u) & need:
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Forbidden")
         return u
     return dep
 
-@router.post("/token", response_model=TokenPair)
-def token_form(form: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+@router.post("/token", response_model=TokenPair, response_class=FastJSONResponse)
+def token_form(_: None = Depends(login_gate), form: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
     u = db.query(User).filter_by(username=form.username).one_or_none()
     if not u or not verify_password(form.password, u.password_hash):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Incorrect username or password")
     return _issue_pair(u, db)
 
-@router.post("/token_json", response_model=TokenPair)
-def token_json(body: LoginBody, db: Session = Depends(get_db)):
+@router.post("/token_json", response_model=TokenPair, response_class=FastJSONResponse)
+def token_json(body: LoginBody, _: None = Depends(login_gate), db: Session = Depends(get_db)):
     u = db.query(User).filter_by(username=body.username).one_or_none()
     if not u or not verify_password(body.password, u.password_hash):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Incorrect username or password")
     return _issue_pair(u, db)
 
-@router.post("/token/refresh", response_model=TokenPair)
-def refresh(body: RefreshBody, db: Session = Depends(get_db)):
+@router.post("/token/refresh", response_model=TokenPair, response_class=FastJSONResponse)
+def refresh(body: RefreshBody, _: None = Depends(refresh_gate), db: Session = Depends(get_db)):
     h = sha256(body.refresh_token)
     rt = db.query(RefreshToken).filter(RefreshToken.token_hash == h).one_or_none()
     if not rt or rt.expires_at < now() or rt.revoked_at is not None:
@@ -91,9 +124,40 @@ def refresh(body: RefreshBody, db: Session = Depends(get_db)):
 @router.post("/logout")
 def logout(u: User = Depends(_require_user), db: Session = Depends(get_db)):
     db.query(RefreshToken).filter(RefreshToken.user_id == u.id).delete(synchronize_session=False)
+    # revoke outstanding access tokens too; published to services via /revocations.
+    # whole seconds, like iat, so "iat <= issued_before" is unambiguous
+    t = now().replace(microsecond=0)
+    if db.get_bind().dialect.name == "postgresql":
+        # self-conflicting lock: ids are assigned and committed in order, which
+        # the feed's since=<seq> cursor relies on; plain reads are not blocked
+        db.execute(text("LOCK TABLE revocations IN SHARE ROW EXCLUSIVE MODE"))
+    db.query(Revocation).filter(Revocation.expires_at < t).delete(synchronize_session=False)
+    db.add(Revocation(subject=u.username, issued_before=t, expires_at=t + timedelta(minutes=ACCESS_MIN)))
     db.commit()
     return {"detail": "ok"}
 
+@router.get("/revocations")
+def revocations(request: Request, since: int = 0, db: Session = Depends(get_db)):
+    """Delta feed of live revocations with seq > since; `version` is the newest seq.
+
+    A version lower than `since` means the feed was reset and clients should
+    start over from since=0. Subjects are published as sha256 hex digests.
+    Service-only: callers present ``Authorization: Bearer <REVOCATIONS_TOKEN>``.
+    """
+    if not REVOCATIONS_TOKEN:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not secrets.compare_digest(token.strip().encode(), REVOCATIONS_TOKEN.encode()):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid service credentials",
+                            headers={"WWW-Authenticate": "Bearer"})
+    version = db.query(func.max(Revocation.id)).scalar() or 0
+    rows = (db.query(Revocation)
+            .filter(Revocation.id > since, Revocation.expires_at > now())
+            .order_by(Revocation.id.asc()).all())
+    entries = [{"seq": r.id, "sub_sha256": sha256(r.subject),
+                "before": int(r.issued_before.timestamp()), "exp": int(r.expires_at.timestamp())} for r in rows]
+    return {"version": version, "entries": entries}
+
 @router.get("/auth/me")
 def me(u: User = Depends(_require_user)):
     return {"username": u.username, "roles": _roles(u)}
@@ -103,17 +167,17 @@ class RegisterBody(BaseModel):
     password: str
 
 @router.post("/register")
-def register(body: RegisterBody, db: Session = Depends(get_db)):
+def register(body: RegisterBody, _: None = Depends(login_gate), db: Session = Depends(get_db)):
     if db.query(User).filter_by(username=body.username).one_or_none():
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Username already exists")
     u = User(username=body.username, password_hash=get_password_hash(body.password))
     db.add(u); db.commit(); db.refresh(u)
     return {"ok": True, "username": u.username, "roles": _roles(u)}
 
-@router.get("/auth/users")
+@router.get("/auth/users", response_class=FastJSONResponse)
 def list_users(_: User = Depends(_require_roles({"admin"})), db: Session = Depends(get_db)):
     rows = db.query(User).all()
-    return [{"username": r.username, "roles": [x.name for x in r.roles]} for r in rows]
+    return FastJSONResponse([{"username": r.username, "roles": [x.name for x in r.roles]} for r in rows])
 
 @router.post("/auth/users/{username}/roles/{role}")
 def grant_role(username: str, role: str, _: User = Depends(_require_roles({"admin"})), db: Session = Depends(get_db)):
@@ -25,7 +25,7 @@ user_roles = Table(
 
 class Role(Base):
     __tablename__ = "roles"
-    id = Column(Integer, primary_key=True)
+    id = Column(Integer, primary_key=True)  # also the role's bit in the token "rbm" claim; never reused
     name = Column(String(50), unique=True, nullable=False, index=True)
     created_at = Column(DateTime(timezone=True), default=lambda: dt.datetime.now(dt.timezone.utc), nullable=False)
 
@@ -49,6 +49,15 @@ class RefreshToken(Base):
 
 Index("ix_refresh_valid", RefreshToken.user_id, RefreshToken.expires_at)
 
+class Revocation(Base):
+    # access tokens of `subject` issued at or before `issued_before` are revoked;
+    # the row is only interesting until the newest such token expires
+    __tablename__ = "revocations"
+    id = Column(Integer, primary_key=True)  # feed sequence number
+    subject = Column(String(100), nullable=False, index=True)
+    issued_before = Column(DateTime(timezone=True), nullable=False)
+    expires_at = Column(DateTime(timezone=True), nullable=False, index=True)
+
 def create_all(): Base.metadata.create_all(bind=engine)
 
 def get_db() -> Generator[Session, None, None]:
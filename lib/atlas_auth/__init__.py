@@ -1,5 +1,5 @@
-import os, time
-from typing import Dict, Any, Optional, Iterable
+import os, time, hashlib, logging, threading
+from typing import Dict, Any, FrozenSet, Optional, Iterable, Tuple
 import httpx
 from jose import jwt, JWTError
 
@@ -7,9 +7,26 @@ AUTH_JWKS_URL = os.getenv("AUTH_JWKS_URL", "http://api:8000/.well-known/jwks.jso
 AUTH_ISSUER   = os.getenv("AUTH_ISSUER", "buildaxis-auth")
 AUTH_AUDIENCE = os.getenv("AUTH_AUDIENCE", "atlas-ai")
 JWKS_TTL_SEC  = int(os.getenv("JWKS_TTL_SEC", "300"))
+# a token with an unknown kid forces at most one JWKS refetch per this many seconds,
+# and the kid is then remembered as unknown for as long
+JWKS_REFETCH_MIN_SEC = float(os.getenv("JWKS_REFETCH_MIN_SEC", "30"))
+# role name -> bit table for the "rbm" claim, refreshed together with the JWKS
+AUTH_ROLES_URL = os.getenv("AUTH_ROLES_URL", "http://api:8000/.well-known/roles.json")
+# empty AUTH_REVOCATIONS_URL disables revocation checks
+AUTH_REVOCATIONS_URL = os.getenv("AUTH_REVOCATIONS_URL", "http://api:8000/revocations")
+REVOCATION_POLL_SEC  = float(os.getenv("REVOCATION_POLL_SEC", "5"))
+# service credential for the feed; must match REVOCATIONS_TOKEN on the auth API
+AUTH_REVOCATIONS_TOKEN = os.getenv("AUTH_REVOCATIONS_TOKEN", "")
+
+log = logging.getLogger("atlas_auth")
 
 _cache_jwks: Optional[Dict[str, Any]] = None
 _cache_expiry: float = 0.0
+_role_bits: Dict[str, int] = {}
+_role_bits_version: int = 0
+_last_forced_fetch: float = 0.0
+_unknown_kids: Dict[str, float] = {}  # kid -> forget at
+_refetch_lock = threading.Lock()
 
 def _now() -> float: return time.time()
 
@@ -22,14 +39,118 @@ def fetch_jwks(force: bool = False) -> Dict[str, Any]:
         resp.raise_for_status()
         _cache_jwks = resp.json()
         _cache_expiry = _now() + JWKS_TTL_SEC
+        _refresh_role_bits(client)
         return _cache_jwks
 
+def _refresh_role_bits(client: httpx.Client) -> None:
+    global _role_bits, _role_bits_version
+    try:
+        resp = client.get(AUTH_ROLES_URL)
+        resp.raise_for_status()
+        bits = resp.json().get("roles") or {}
+    except Exception as e:
+        # role checks fall back to the "roles" name list
+        log.warning("role table fetch failed: %s", e)
+        return
+    if bits != _role_bits:
+        _role_bits = bits
+        _role_bits_version += 1
+
+def jwks_is_fresh() -> bool:
+    return bool(_cache_jwks) and _now() < _cache_expiry
+
+def _refetch_allowed(kid: str) -> bool:
+    t = _now()
+    return _unknown_kids.get(kid, 0.0) <= t and t - _last_forced_fetch >= JWKS_REFETCH_MIN_SEC
+
+def verification_may_fetch(token: str) -> bool:
+    """True when decode_and_validate(token) could do network I/O; async callers should use a thread."""
+    if not jwks_is_fresh():
+        return True
+    try:
+        kid = jwt.get_unverified_header(token).get("kid")
+    except Exception:
+        return False  # rejected before any fetch
+    return bool(kid) and _find_key(_cache_jwks, kid) is None and _refetch_allowed(kid)
+
+def _refetch_for(kid: str) -> Optional[Dict[str, Any]]:
+    # throttled so made-up kids can't turn every request into a JWKS fetch
+    global _last_forced_fetch
+    with _refetch_lock:
+        key = _find_key(_cache_jwks, kid)   # another thread may have just refetched
+        if key is not None or not _refetch_allowed(kid):
+            return key
+        _last_forced_fetch = _now()
+        key = _find_key(fetch_jwks(force=True), kid)
+        if key is None:
+            if len(_unknown_kids) > 1024:
+                _unknown_kids.clear()
+            _unknown_kids[kid] = _now() + JWKS_REFETCH_MIN_SEC
+        return key
+
+# sha256(sub) -> (revoke tokens with iat <= before, drop entry after exp); replaced wholesale by the poller
+_revoked: Dict[str, Tuple[int, int]] = {}
+_revocation_version: int = 0
+_poller: Optional[threading.Thread] = None
+_poller_lock = threading.Lock()
+
+def poll_revocations() -> None:
+    """Fetch revocations newer than the last seen version and merge them in."""
+    global _revoked, _revocation_version
+    since, base = _revocation_version, _revoked
+    headers = {"Authorization": f"Bearer {AUTH_REVOCATIONS_TOKEN}"} if AUTH_REVOCATIONS_TOKEN else {}
+    with httpx.Client(timeout=5.0, headers=headers) as client:
+        feed = _fetch_revocations(client, since)
+        if int(feed.get("version", 0)) < since:
+            # feed was reset on the auth side; rebuild from scratch, keeping the old table until done
+            since, base = 0, {}
+            feed = _fetch_revocations(client, since)
+    version = int(feed.get("version", 0))
+    t = int(_now())
+    revoked = {sub: v for sub, v in base.items() if v[1] > t}
+    for e in feed.get("entries", []):
+        before, exp = revoked.get(e["sub_sha256"], (0, 0))
+        revoked[e["sub_sha256"]] = (max(before, e["before"]), max(exp, e["exp"]))
+        version = max(version, e["seq"])
+    _revoked, _revocation_version = revoked, version
+
+def _fetch_revocations(client: httpx.Client, since: int) -> Dict[str, Any]:
+    resp = client.get(AUTH_REVOCATIONS_URL, params={"since": since})
+    resp.raise_for_status()
+    return resp.json()
+
+def _poll_forever() -> None:
+    while True:
+        try:
+            poll_revocations()
+        except Exception as e:
+            log.warning("revocation poll failed: %s", e)
+        time.sleep(REVOCATION_POLL_SEC)
+
+def _ensure_poller() -> None:
+    global _poller
+    if _poller is not None or not AUTH_REVOCATIONS_URL:
+        return
+    with _poller_lock:
+        if _poller is None:
+            _poller = threading.Thread(target=_poll_forever, name="atlas-auth-revocations", daemon=True)
+            _poller.start()
+
+def is_revoked(claims: Dict[str, Any]) -> bool:
+    revoked = _revoked
+    if not revoked:
+        return False
+    entry = revoked.get(hashlib.sha256(str(claims.get("sub")).encode("utf-8")).hexdigest())
+    return entry is not None and claims.get("iat", 0) <= entry[0]
+
 def _find_key(jwks: Dict[str, Any], kid: Optional[str]) -> Optional[Dict[str, Any]]:
     keys = (jwks or {}).get("keys") or []
     if kid:
+        # a kid we don't know yet must trigger a refetch, never a fallback to another key
         for k in keys:
             if k.get("kid") == kid:
                 return k
+        return None
     return keys[0] if keys else None
 
 def decode_and_validate(token: str) -> Dict[str, Any]:
@@ -41,11 +162,13 @@ def decode_and_validate(token: str) -> Dict[str, Any]:
     kid = header.get("kid")
 
     jwks = fetch_jwks()
-    key = _find_key(jwks, kid) or _find_key(fetch_jwks(force=True), kid)
+    key = _find_key(jwks, kid)
+    if key is None and kid:
+        key = _refetch_for(kid)
     if key is None:
         raise JWTError("No matching JWK")
 
-    return jwt.decode(
+    claims = jwt.decode(
         token,
         key,
         algorithms=[alg],
@@ -53,10 +176,55 @@ def decode_and_validate(token: str) -> Dict[str, Any]:
         issuer=AUTH_ISSUER,
         options={"verify_aud": True},
     )
+    _ensure_poller()
+    if is_revoked(claims):
+        raise JWTError("Token revoked")
+    return claims
+
+class RoleSet:
+    """A role requirement compiled to a bitmask against the published role table.
+
+    With a token carrying "rbm" and every required role known to the table the
+    check is a single AND; otherwise it falls back to the "roles" name list.
+    """
+    __slots__ = ("names", "mask", "complete", "version")
+
+    def __init__(self, names: Iterable[str]):
+        self.names: FrozenSet[str] = frozenset(names)
+        self.mask = 0
+        self.complete = False
+        self.version = -1
+
+    def _compile(self) -> None:
+        bits = _role_bits
+        mask = 0
+        for name in self.names:
+            if name in bits:
+                mask |= 1 << bits[name]
+        self.mask, self.complete = mask, len(self.names) > 0 and all(n in bits for n in self.names)
+        self.version = _role_bits_version
+
+    def allows(self, claims: Dict[str, Any]) -> bool:
+        if self.version != _role_bits_version:
+            self._compile()
+        rbm = claims.get("rbm")
+        if rbm is not None and self.complete:
+            return bool(rbm & self.mask)
+        return not self.names.isdisjoint(claims.get("roles") or ())
+
+# compiled RoleSets for callers passing plain names; requirements are static, so this stays small
+_role_sets: Dict[FrozenSet[str], RoleSet] = {}
 
 def has_any_role(claims: Dict[str, Any], required: Iterable[str]) -> bool:
-    have = set(claims.get("roles", []) or [])
-    need = set(required or [])
-    return bool(have & need)
+    """Prefer passing a module-level RoleSet; plain names are compiled once and cached."""
+    if not isinstance(required, RoleSet):
+        key = frozenset(required or ())
+        rs = _role_sets.get(key)
+        if rs is None:
+            rs = _role_sets[key] = RoleSet(key)
+        required = rs
+    return required.allows(claims)
+
+from .middleware import AuthMiddleware, bearer_token
 
-__all__ = ["decode_and_validate", "has_any_role", "fetch_jwks"]
+__all__ = ["decode_and_validate", "has_any_role", "RoleSet", "fetch_jwks", "jwks_is_fresh", "verification_may_fetch", "poll_revocations", "is_revoked", "AuthMiddleware", "bearer_token"]
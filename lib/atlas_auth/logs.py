@@ -0,0 +1,143 @@
+import os, sys, json, time, queue, random, atexit, logging, logging.handlers
+from typing import Any, Dict, Optional
+
+LOG_LEVEL       = os.getenv("LOG_LEVEL", "INFO")
+LOG_QUEUE_MAX   = int(os.getenv("LOG_QUEUE_MAX", "10000"))
+# fraction of successful (< 400) access logs that are written; warnings and errors are always kept
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "1.0"))
+# records dropped on a full queue are reported in one warning at most this often
+LOG_DROP_REPORT_SEC = float(os.getenv("LOG_DROP_REPORT_SEC", "10"))
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+class JsonFormatter(logging.Formatter):
+    def __init__(self, service: str):
+        super().__init__()
+        self.service = service
+
+    def format(self, record: logging.LogRecord) -> str:
+        doc: Dict[str, Any] = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "service": self.service,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        ctx = getattr(record, "ctx", None)
+        if ctx:
+            doc.update(ctx)
+        if record.exc_info:
+            doc["exc"] = self.formatException(record.exc_info)
+        return json.dumps(doc, default=str)
+
+class SampleFilter(logging.Filter):
+    """Keep records logged with extra={"sampled": True} at LOG_SAMPLE_RATE, everything else always."""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or not getattr(record, "sampled", False):
+            return True
+        return random.random() < self.rate
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    # the stock handler formats in the caller and blocks/raises on a full queue;
+    # here the caller only resolves the message and a full queue drops the record
+    dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class _QueueListener(logging.handlers.QueueListener):
+    """Writer thread that also reports what the queue handler had to drop."""
+
+    def __init__(self, q: "queue.Queue[logging.LogRecord]", source: _QueueHandler, *handlers: logging.Handler):
+        super().__init__(q, *handlers)
+        self.source = source
+        self.reported = 0
+        self.next_report = 0.0
+
+    def handle(self, record: logging.LogRecord) -> None:
+        super().handle(record)
+        # the queue only fills up when this thread is busy, so checking per record is often enough
+        dropped = self.source.dropped
+        if dropped > self.reported and time.monotonic() >= self.next_report:
+            self.next_report = time.monotonic() + LOG_DROP_REPORT_SEC
+            n, self.reported = dropped - self.reported, dropped
+            super().handle(logging.makeLogRecord({
+                "name": __name__, "levelno": logging.WARNING, "levelname": "WARNING",
+                "msg": f"log queue full, dropped {n} records", "ctx": {"dropped": n},
+            }))
+
+def setup_logging(service: str) -> None:
+    """Route all logging through a bounded queue to a JSON writer thread on stdout."""
+    global _listener
+    if _listener is not None:
+        return
+    q: "queue.Queue[logging.LogRecord]" = queue.Queue(maxsize=LOG_QUEUE_MAX)
+    out = logging.StreamHandler(sys.stdout)
+    out.setFormatter(JsonFormatter(service))
+    handler = _QueueHandler(q)
+    handler.addFilter(SampleFilter(LOG_SAMPLE_RATE))
+
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(LOG_LEVEL)
+    # uvicorn installs its own synchronous stream handlers; send its records through the queue too
+    for name in ("uvicorn", "uvicorn.error", "uvicorn.access"):
+        lg = logging.getLogger(name)
+        lg.handlers[:] = []
+        lg.propagate = True
+    # per-request chatter from the JWKS/revocation pollers
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    _listener = _QueueListener(q, handler, out)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+class AccessLogMiddleware:
+    """One structured log line per HTTP request: route, status, latency and subject."""
+
+    def __init__(self, app, logger: str = "access"):
+        self.app = app
+        self.log = logging.getLogger(logger)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = 500
+
+        async def _send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, _send)
+        finally:
+            route = getattr(scope.get("route"), "path", None) or scope["path"]
+            claims = scope.get("state", {}).get("claims") or {}
+            level = logging.ERROR if status >= 500 else logging.WARNING if status >= 400 else logging.INFO
+            self.log.log(level, "%s %s %d", scope["method"], route, status, extra={
+                "sampled": status < 400,
+                "ctx": {
+                    "method": scope["method"],
+                    "route": route,
+                    "status": status,
+                    "latency_ms": round((time.perf_counter() - start) * 1000, 2),
+                    "sub": claims.get("sub"),
+                },
+            })
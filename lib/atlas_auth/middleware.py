@@ -0,0 +1,81 @@
+import json, re
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional, Pattern, Tuple
+
+import anyio
+
+from . import decode_and_validate, verification_may_fetch, RoleSet
+
+# (method, path template, roles) e.g. ("POST", "/projects", {"admin"}); "*" matches any method
+RoleRule = Tuple[str, str, Iterable[str]]
+
+DEFAULT_PUBLIC_PATHS = ("/health", "/healthz", "/docs", "/docs/oauth2-redirect", "/redoc", "/openapi.json")
+
+def _compile_path(template: str) -> Pattern[str]:
+    # "/projects/{code}" -> ^/projects/[^/]+$
+    parts = re.split(r"\{[^}]+\}", template)
+    return re.compile("^" + "[^/]+".join(re.escape(p) for p in parts) + "$")
+
+def bearer_token(scope: Dict[str, Any]) -> Optional[str]:
+    for name, value in scope.get("headers", ()):
+        if name == b"authorization":
+            if value[:7].lower() != b"bearer ":
+                return None
+            return value[7:].strip().decode("latin-1") or None
+    return None
+
+class AuthMiddleware:
+    """Verify the bearer token once per request, before routing.
+
+    Claims end up on ``request.state.claims``; requests without a valid token
+    get a 401 and requests missing a role required by ``role_rules`` get a 403
+    without ever reaching the router.
+    """
+
+    def __init__(self, app, role_rules: Iterable[RoleRule] = (), public_paths: Iterable[str] = DEFAULT_PUBLIC_PATHS):
+        self.app = app
+        self.public_paths: FrozenSet[str] = frozenset(public_paths)
+        self.rules: Dict[str, List[Tuple[Pattern[str], RoleSet]]] = {}
+        for method, template, roles in role_rules:
+            self.rules.setdefault(method.upper(), []).append((_compile_path(template), RoleSet(roles)))
+
+    def _required(self, method: str, path: str) -> Optional[RoleSet]:
+        for rules in (self.rules.get(method), self.rules.get("*")):
+            for pattern, roles in rules or ():
+                if pattern.match(path):
+                    return roles
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.public_paths:
+            await self.app(scope, receive, send)
+            return
+
+        token = bearer_token(scope)
+        if token is None:
+            await _reject(send, 401, "Missing bearer token")
+            return
+        try:
+            if verification_may_fetch(token):
+                # a JWKS fetch is blocking network I/O; keep it off the event loop
+                claims = await anyio.to_thread.run_sync(decode_and_validate, token)
+            else:
+                claims = decode_and_validate(token)
+        except Exception as e:
+            await _reject(send, 401, f"Invalid token: {e}")
+            return
+
+        need = self._required(scope["method"], scope["path"])
+        if need is not None and not need.allows(claims):
+            await _reject(send, 403, "Insufficient role")
+            return
+
+        scope.setdefault("state", {})["claims"] = claims
+        await self.app(scope, receive, send)
+
+async def _reject(send, status: int, detail: str) -> None:
+    body = json.dumps({"detail": detail}).encode("utf-8")
+    headers = [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode("ascii"))]
+    if status == 401:
+        headers.append((b"www-authenticate", b"Bearer"))
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,211 @@
+import os, re, sys, json, time, random, secrets, threading
+from collections import Counter
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import anyio
+
+from . import decode_and_validate, verification_may_fetch, RoleSet
+from .middleware import bearer_token, _reject
+
+PROFILE_ENABLED     = os.getenv("PROFILE_ENABLED", "0") == "1"
+# fraction of all requests profiled without being asked to
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "2"))
+PROFILE_DIR         = os.getenv("PROFILE_DIR", "/tmp/profiles")
+PROFILE_KEEP        = int(os.getenv("PROFILE_KEEP", "50"))
+
+PROFILE_HEADER = b"x-profile"
+PROFILES_PATH  = "/_profiles"
+_ADMIN = RoleSet({"admin"})
+
+# a thread whose innermost frame is in one of these is parked, not working
+_IDLE_FILES = ("threading.py", "queue.py", "selectors.py")
+# background threads that would only add noise
+_SKIP_THREADS = ("atlas-auth-revocations", "profile-sampler")
+# where request time tends to go; reported as sample counts next to the raw stacks
+_LIBS = {"sqlalchemy": "/sqlalchemy/", "bcrypt": "/passlib/", "jose": "/jose/"}
+
+def _label(code) -> str:
+    path = code.co_filename
+    cut = path.rfind("site-packages/")
+    path = path[cut + 14:] if cut >= 0 else os.path.basename(path)
+    return f"{code.co_name} ({path}:{code.co_firstlineno})"
+
+class _Sampler(threading.Thread):
+    """Samples the stacks of every busy thread in the process until stopped.
+
+    Sync endpoints run on threadpool workers, so a single-thread profiler
+    (cProfile) would miss the DB, bcrypt and JWT work. Stacks of other
+    requests running concurrently in the same worker are captured too.
+    Requests profiled at the same time share one sampler (see ``users``) and
+    each takes the difference of two snapshots.
+    """
+
+    def __init__(self, interval: float):
+        super().__init__(name="profile-sampler", daemon=True)
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.libs: Counter = Counter()
+        self.samples = 0
+        self.users = 0  # requests currently profiled with this sampler; touched on the event loop only
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+
+    def run(self) -> None:
+        while not self._stop_event.wait(self.interval):
+            skip = {t.ident for t in threading.enumerate() if t.name in _SKIP_THREADS}
+            stacks: Counter = Counter()
+            libs: Counter = Counter()
+            for tid, frame in sys._current_frames().items():
+                if tid in skip or os.path.basename(frame.f_code.co_filename) in _IDLE_FILES:
+                    continue
+                codes = []
+                while frame is not None:
+                    codes.append(frame.f_code)
+                    frame = frame.f_back
+                stacks[";".join(_label(c) for c in reversed(codes))] += 1
+                files = "|".join(c.co_filename for c in codes)
+                for lib, marker in _LIBS.items():
+                    if marker in files:
+                        libs[lib] += 1
+            with self._lock:
+                self.samples += 1
+                self.stacks.update(stacks)
+                self.libs.update(libs)
+
+    def snapshot(self) -> Tuple[int, Counter, Counter]:
+        with self._lock:
+            return self.samples, Counter(self.stacks), Counter(self.libs)
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self.join()
+
+# at most one sampler per process; only read and swapped on the event loop
+_active: Optional[_Sampler] = None
+
+def _store(profile: Dict[str, Any]) -> None:
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(PROFILE_DIR, profile["id"] + ".json")
+    with open(path + ".tmp", "w") as f:
+        json.dump(profile, f)
+    os.replace(path + ".tmp", path)
+    # ids sort chronologically; keep the newest PROFILE_KEEP
+    names = sorted(n for n in os.listdir(PROFILE_DIR) if n.endswith(".json"))
+    for name in names[:-PROFILE_KEEP]:
+        try:
+            os.remove(os.path.join(PROFILE_DIR, name))
+        except FileNotFoundError:
+            pass  # pruned by a concurrent _store (another request or worker)
+
+def _load(profile_id: Optional[str]) -> Optional[bytes]:
+    if profile_id is None:
+        names = sorted(n[:-5] for n in os.listdir(PROFILE_DIR) if n.endswith(".json")) if os.path.isdir(PROFILE_DIR) else []
+        return json.dumps({"profiles": names[::-1]}).encode("utf-8")
+    if not re.fullmatch(r"[0-9]+-[0-9a-f]+", profile_id):
+        return None
+    try:
+        with open(os.path.join(PROFILE_DIR, profile_id + ".json"), "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+class ProfilingMiddleware:
+    """Opt-in per-request stack sampling (PROFILE_ENABLED=1).
+
+    A request is profiled when an admin sends ``X-Profile: 1`` or when it is
+    picked at PROFILE_SAMPLE_RATE. Profiles go to a ring buffer of
+    PROFILE_KEEP files in PROFILE_DIR; the response carries ``X-Profile-Id``
+    and admins fetch ``/_profiles`` (index) or ``/_profiles/<id>``.
+
+    Only one sampler runs per process. While it runs, requests are not
+    picked at PROFILE_SAMPLE_RATE; admin ``X-Profile`` requests attach to it.
+    """
+
+    def __init__(self, app, verify: Callable[[str], Dict[str, Any]] = decode_and_validate):
+        self.app = app
+        self.verify = verify
+
+    async def _is_admin(self, scope) -> bool:
+        token = bearer_token(scope)
+        if token is None:
+            return False
+        try:
+            if verification_may_fetch(token):
+                # verify may fetch the JWKS (blocking I/O); keep it off the event loop
+                claims = await anyio.to_thread.run_sync(self.verify, token)
+            else:
+                claims = self.verify(token)
+            return _ADMIN.allows(claims)
+        except Exception:
+            return False
+
+    async def __call__(self, scope, receive, send):
+        global _active
+        if not PROFILE_ENABLED or scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        path = scope["path"]
+        if path == PROFILES_PATH or path.startswith(PROFILES_PATH + "/"):
+            await self._download(scope, send, path[len(PROFILES_PATH) + 1:] or None)
+            return
+
+        asked = any(k == PROFILE_HEADER and v == b"1" for k, v in scope.get("headers", ()))
+        if not (asked and await self._is_admin(scope)) and not (_active is None and random.random() < PROFILE_SAMPLE_RATE):
+            await self.app(scope, receive, send)
+            return
+
+        profile_id = f"{int(time.time() * 1000)}-{secrets.token_hex(3)}"
+        status = 500
+
+        async def _send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [(b"x-profile-id", profile_id.encode("ascii"))]
+            await send(message)
+
+        sampler = _active
+        if sampler is None:
+            sampler = _active = _Sampler(PROFILE_INTERVAL_MS / 1000.0)
+            sampler.start()
+        sampler.users += 1
+        base_samples, base_stacks, base_libs = sampler.snapshot()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, _send)
+        finally:
+            samples, stacks, libs = sampler.snapshot()
+            sampler.users -= 1
+            if sampler.users == 0:
+                _active = None
+                # join waits out a sampling pass over every thread stack
+                await anyio.to_thread.run_sync(sampler.stop)
+            await anyio.to_thread.run_sync(_store, {
+                "id": profile_id,
+                "method": scope["method"],
+                "path": path,
+                "status": status,
+                "duration_ms": round((time.perf_counter() - start) * 1000, 2),
+                "interval_ms": PROFILE_INTERVAL_MS,
+                "samples": samples - base_samples,
+                "libs": dict(libs - base_libs),
+                # collapsed stacks ("root;...;leaf": count), ready for flamegraph tools
+                "stacks": dict((stacks - base_stacks).most_common()),
+            })
+
+    async def _download(self, scope, send, profile_id: Optional[str]) -> None:
+        if bearer_token(scope) is None:
+            await _reject(send, 401, "Missing bearer token")
+            return
+        if not await self._is_admin(scope):
+            await _reject(send, 403, "Insufficient role")
+            return
+        body = await anyio.to_thread.run_sync(_load, profile_id)
+        if body is None:
+            await _reject(send, 404, "Not found")
+            return
+        await send({"type": "http.response.start", "status": 200, "headers": [
+            (b"content-type", b"application/json"), (b"content-length", str(len(body)).encode("ascii"))]})
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,22 @@
+import json
+from typing import Any
+
+from starlette.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # stdlib fallback, still skips FastAPI's encoder
+    orjson = None
+
+class FastJSONResponse(JSONResponse):
+    """JSON rendered straight to bytes.
+
+    Returning one of these from an endpoint bypasses FastAPI's jsonable_encoder
+    and response_model validation, so only use it where the content is already
+    plain JSON types of the documented shape.
+    """
+
+    def render(self, content: Any) -> bytes:
+        if orjson is not None:
+            return orjson.dumps(content)
+        return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
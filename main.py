@@ -1,15 +1,18 @@
 import os, time, json, logging
 from datetime import datetime, timezone
-from fastapi import FastAPI, Response
+from fastapi import FastAPI, Response, Depends
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy import text
 from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
 
-from db import engine, create_all, SessionLocal, seed_admin
-from security import jwks
+from db import engine, create_all, SessionLocal, seed_admin, get_db, Role
+from security import jwks, decode_and_validate
 from auth_endpoints import router as auth_router
+from atlas_auth.logs import setup_logging, AccessLogMiddleware
+from atlas_auth.profiling import ProfilingMiddleware
 
-logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+setup_logging("auth-api")
 log = logging.getLogger("app")
 
 app = FastAPI(title="BuildAxis Auth API", version="1.0.0")
@@ -28,6 +31,8 @@ if allow_origins:
         allow_methods=["*"],
         allow_headers=["*"],
     )
+app.add_middleware(ProfilingMiddleware, verify=decode_and_validate)
+app.add_middleware(AccessLogMiddleware)
 
 def wait_for_db(timeout=60):
     start = time.time()
@@ -64,4 +69,11 @@ def get_jwks():
     return Response(content=json.dumps(data), media_type="application/json",
                     headers={"Cache-Control": "public, max-age=300"})
 
+@app.get("/.well-known/roles.json")
+def get_roles(db: Session = Depends(get_db)):
+    # role name -> bit in the access token "rbm" claim
+    data = {"roles": {r.name: r.id for r in db.query(Role).all()}}
+    return Response(content=json.dumps(data), media_type="application/json",
+                    headers={"Cache-Control": "public, max-age=300"})
+
 app.include_router(auth_router)
@@ -0,0 +1,29 @@
+"""Render a 1,000-item list page through FastAPI's default path and FastJSONResponse.
+
+    PYTHONPATH=lib python scripts/bench_json.py
+"""
+import timeit
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from atlas_auth.responses import FastJSONResponse, orjson
+
+N, ROUNDS = 1000, 200
+page = {
+    "items": [{"id": i, "name": f"Project {i}", "code": f"BA-{i:05d}", "description": "Flagship build " * 4} for i in range(N)],
+    "count": N,
+}
+
+def default_path():
+    # what FastAPI does with a dict returned from an endpoint
+    return JSONResponse(jsonable_encoder(page)).body
+
+def fast_path():
+    return FastJSONResponse(page).body
+
+assert len(default_path()) > 0 and len(fast_path()) > 0
+for name, fn in (("default (jsonable_encoder + json)", default_path),
+                 ("FastJSONResponse (%s)" % ("orjson" if orjson else "json"), fast_path)):
+    per = min(timeit.repeat(fn, number=ROUNDS, repeat=5)) / ROUNDS
+    print(f"{name:40s} {per * 1e3:8.3f} ms/page  {len(fn()):7d} bytes")
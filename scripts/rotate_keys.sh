@@ -0,0 +1,6 @@
+#!/usr/bin/env bash
+set -Eeuo pipefail
+# Stage a new JWT signing key on the shared key volume. It is published in the JWKS at once
+# and starts signing after JWKS_TTL_SEC + KEY_POLL_SEC; the previous key stays in the JWKS
+# until its tokens expire.
+docker compose exec -T api python security.py rotate
@@ -1,8 +1,9 @@
-import os, base64, secrets, json
-from typing import Any, List, Optional, Set, Dict
+import os, sys, math, base64, secrets, json, time, fcntl, threading
+from contextlib import contextmanager
+from typing import Any, Iterable, List, NamedTuple, Optional, Dict
 from datetime import datetime, timedelta, timezone
 
-from jose import jwt
+from jose import jwt, JWTError
 from cryptography.hazmat.primitives.asymmetric import rsa
 from cryptography.hazmat.primitives import serialization, hashes
 
@@ -10,8 +11,18 @@ ISSUER     = os.getenv("JWT_ISSUER", "buildaxis-auth")
 AUDIENCE   = os.getenv("JWT_AUDIENCE", "atlas-ai")
 ACCESS_MIN = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "15"))
 KEY_DIR    = os.getenv("KEY_DIR", "/app/keys")
+# how often each worker stats the key ring for changes made by other workers / rotations
+KEY_POLL_SEC   = float(os.getenv("KEY_POLL_SEC", "5"))
+# retired keys stay in the JWKS until every token they signed has expired
+KEY_RETAIN_SEC = int(os.getenv("KEY_RETAIN_SEC", str(ACCESS_MIN * 60 + 60)))
+# how long consumers may cache the JWKS; a rotated-in key is published this long (plus a poll) before it signs
+JWKS_TTL_SEC   = int(os.getenv("JWKS_TTL_SEC", "300"))
 
 os.makedirs(KEY_DIR, exist_ok=True)
+# {"current": kid, "retired": {kid: retired_at}, "next": kid | null, "promote_at": epoch}
+RING_PATH = os.path.join(KEY_DIR, "keyring.json")
+LOCK_PATH = os.path.join(KEY_DIR, ".lock")
+# single-key layout used before the key ring; adopted as the first current key
 PRIV_PATH = os.path.join(KEY_DIR, "private.pem")
 PUB_PATH  = os.path.join(KEY_DIR, "public.pem")
 KID_PATH  = os.path.join(KEY_DIR, "kid.txt")
@@ -19,9 +30,40 @@ KID_PATH  = os.path.join(KEY_DIR, "kid.txt")
 def _b64url(data: bytes) -> str:
     return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
 
-def _ensure_rsa() -> None:
-    if os.path.exists(PRIV_PATH) and os.path.exists(PUB_PATH) and os.path.exists(KID_PATH):
-        return
+def _key_paths(kid: str):
+    return os.path.join(KEY_DIR, f"{kid}.key.pem"), os.path.join(KEY_DIR, f"{kid}.pub.pem")
+
+@contextmanager
+def _locked():
+    # serializes key creation/rotation across workers and replicas sharing KEY_DIR
+    with open(LOCK_PATH, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def _atomic_write(path: str, data: bytes) -> None:
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+def _write_ring(current: str, retired: Dict[str, int], next_kid: Optional[str] = None, promote_at: int = 0) -> None:
+    ring = {"current": current, "retired": retired, "next": next_kid, "promote_at": promote_at}
+    _atomic_write(RING_PATH, json.dumps(ring).encode("utf-8"))
+
+def _promote_due(ring: Dict[str, Any], t: float) -> Dict[str, Any]:
+    # a staged key whose publish window has passed is the current key
+    if not ring.get("next") or ring["promote_at"] > t:
+        return ring
+    retired = dict(ring.get("retired", {}))
+    retired[ring["current"]] = ring["promote_at"]
+    return {"current": ring["next"], "retired": retired, "next": None, "promote_at": 0}
+
+def _new_key() -> str:
     key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
     priv_pem = key.private_bytes(
         encoding=serialization.Encoding.PEM,
@@ -40,47 +82,176 @@ def _ensure_rsa() -> None:
     digest = hashes.Hash(hashes.SHA256()); digest.update(spki_der)
     kid = digest.finalize()[:8].hex()
 
-    with open(PRIV_PATH, "wb") as f: f.write(priv_pem)
-    with open(PUB_PATH,  "wb") as f: f.write(pub_pem)
-    with open(KID_PATH,  "w")  as f: f.write(kid)
+    priv_path, pub_path = _key_paths(kid)
+    _atomic_write(priv_path, priv_pem)
+    _atomic_write(pub_path, pub_pem)
+    return kid
+
+def _ensure_ring() -> None:
+    if os.path.exists(RING_PATH):
+        return
+    with _locked():
+        if os.path.exists(RING_PATH):   # another worker got there first
+            return
+        if os.path.exists(PRIV_PATH) and os.path.exists(PUB_PATH) and os.path.exists(KID_PATH):
+            with open(KID_PATH, "r") as f: kid = f.read().strip()
+            priv_path, pub_path = _key_paths(kid)
+            with open(PRIV_PATH, "rb") as f: _atomic_write(priv_path, f.read())
+            with open(PUB_PATH,  "rb") as f: _atomic_write(pub_path, f.read())
+        else:
+            kid = _new_key()
+        _write_ring(kid, {})
+
+def rotate_keys() -> str:
+    """Stage a fresh key; it is published in the JWKS right away and signs from `promote_at`.
+
+    The delay lets every worker poll the ring and every consumer's JWKS cache
+    expire, so no service sees a token signed with a kid it cannot fetch yet.
+    The old key keeps verifying until its tokens expire.
+    """
+    _ensure_ring()
+    with _locked():
+        t = int(time.time())
+        with open(RING_PATH, "rb") as f: ring = _promote_due(json.load(f), t)
+        if ring.get("next"):
+            raise RuntimeError(f"key {ring['next']} is already staged until {ring['promote_at']}")
+        retired = {}
+        for kid, retired_at in ring.get("retired", {}).items():
+            if retired_at + KEY_RETAIN_SEC > t:
+                retired[kid] = retired_at
+            else:
+                for path in _key_paths(kid):
+                    if os.path.exists(path): os.remove(path)
+        kid = _new_key()
+        _write_ring(ring["current"], retired, kid, t + JWKS_TTL_SEC + math.ceil(KEY_POLL_SEC))
+    _ring.reload(force=True)
+    return kid
+
+class _KeySet(NamedTuple):
+    kid: str
+    priv: bytes                  # PEM of the current signing key
+    next_kid: Optional[str]      # staged key, signs from promote_at on
+    next_priv: Optional[bytes]
+    promote_at: int
+    pubs: Dict[str, bytes]       # kid -> PEM, current + next + retired
+    retired: Dict[str, int]      # kid -> retired_at (epoch seconds)
+    jwks: Dict[str, Dict[str, Any]]
+
+    def signer(self, t: float):
+        if self.next_kid and t >= self.promote_at:
+            return self.next_kid, self.next_priv
+        return self.kid, self.priv
+
+    def retired_at(self, t: float) -> Dict[str, int]:
+        if self.next_kid and t >= self.promote_at:
+            return {**self.retired, self.kid: self.promote_at}
+        return self.retired
+
+def _jwk(kid: str, pub_pem: bytes) -> Dict[str, Any]:
+    numbers = serialization.load_pem_public_key(pub_pem).public_numbers()
+    n = numbers.n.to_bytes((numbers.n.bit_length() + 7) // 8, "big")
+    e = numbers.e.to_bytes((numbers.e.bit_length() + 7) // 8, "big")
+    return {"kty": "RSA", "use": "sig", "kid": kid, "alg": "RS256", "n": _b64url(n), "e": _b64url(e)}
+
+class KeyRing:
+    """In-process view of KEY_DIR, re-read when keyring.json changes on disk."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stamp = None
+        self._next_check = 0.0
+        self.keys: _KeySet = None  # type: ignore[assignment]
+        self.reload(force=True)
+
+    def reload(self, force: bool = False) -> None:
+        t = time.monotonic()
+        if not force and t < self._next_check:
+            return
+        with self._lock:
+            if not force and t < self._next_check:
+                return
+            self._next_check = t + KEY_POLL_SEC
+            st = os.stat(RING_PATH)
+            stamp = (st.st_ino, st.st_mtime_ns, st.st_size)
+            if stamp == self._stamp:
+                return
+            with open(RING_PATH, "rb") as f: ring = json.load(f)
+            kid, next_kid = ring["current"], ring.get("next")
+            old = self.keys.jwks if self.keys else {}
+            pubs: Dict[str, bytes] = {}
+            for k in [kid, *([next_kid] if next_kid else []), *ring.get("retired", {})]:
+                pub_path = _key_paths(k)[1]
+                if os.path.exists(pub_path):
+                    with open(pub_path, "rb") as f: pubs[k] = f.read()
+            with open(_key_paths(kid)[0], "rb") as f: priv = f.read()
+            next_priv = None
+            if next_kid:
+                with open(_key_paths(next_kid)[0], "rb") as f: next_priv = f.read()
+            jwks = {k: old.get(k) or _jwk(k, pem) for k, pem in pubs.items()}
+            # swap in one assignment so readers never see a half-loaded ring
+            self.keys = _KeySet(kid, priv, next_kid, next_priv, ring.get("promote_at", 0),
+                                pubs, dict(ring.get("retired", {})), jwks)
+            self._stamp = stamp
 
 # initialize key material
-_ensure_rsa()
-with open(PRIV_PATH, "rb") as f: _priv = f.read()   # PEM (bytes)
-with open(PUB_PATH,  "rb") as f: _pub  = f.read()
-with open(KID_PATH,  "r")  as f: _kid  = f.read().strip()
+_ensure_ring()
+_ring = KeyRing()
 
 def now() -> datetime:
     return datetime.now(timezone.utc)
 
-def create_access_token(subject: str, roles: List[str], minutes: Optional[int] = None) -> str:
+def create_access_token(subject: str, roles: List[str], minutes: Optional[int] = None,
+                        role_mask: Optional[int] = None, min_iat: Optional[int] = None) -> str:
     exp_min = minutes if minutes is not None else ACCESS_MIN
     iat = now()
     payload: Dict[str, Any] = {
         "iss": ISSUER,
         "aud": AUDIENCE,
         "sub": subject,
-        "iat": int(iat.timestamp()),
+        # min_iat lifts iat past a revocation cutoff from the same second
+        "iat": max(int(iat.timestamp()), min_iat or 0),
         "nbf": int(iat.timestamp()),
         "exp": int((iat + timedelta(minutes=exp_min)).timestamp()),
         "jti": secrets.token_hex(12),
         "roles": roles or [],
     }
-    return jwt.encode(payload, _priv, algorithm="RS256", headers={"kid": _kid})
+    if role_mask is not None:
+        payload["rbm"] = role_mask  # bit n set <=> role with id n, see /.well-known/roles.json
+    _ring.reload()
+    kid, priv = _ring.keys.signer(time.time())
+    return jwt.encode(payload, priv, algorithm="RS256", headers={"kid": kid})
 
 def jwks() -> Dict[str, Any]:
-    pub = serialization.load_pem_public_key(_pub)
-    numbers = pub.public_numbers()
-    n = numbers.n.to_bytes((numbers.n.bit_length() + 7) // 8, "big")
-    e = numbers.e.to_bytes((numbers.e.bit_length() + 7) // 8, "big")
-    return {"keys": [{
-        "kty": "RSA", "use": "sig", "kid": _kid, "alg": "RS256",
-        "n": _b64url(n), "e": _b64url(e),
-    }]}
+    _ring.reload()
+    keys = _ring.keys
+    t = time.time()
+    kid = keys.signer(t)[0]
+    retired, cutoff = keys.retired_at(t), t - KEY_RETAIN_SEC
+    live = [k for k in keys.jwks if k in (kid, keys.next_kid) or retired.get(k, 0) > cutoff]
+    return {"keys": [keys.jwks[k] for k in live]}
 
 def decode_and_validate(token: str) -> Dict[str, Any]:
-    # validate signature + claims using public key
-    return jwt.decode(token, _pub, algorithms=["RS256"], audience=AUDIENCE, issuer=ISSUER)
+    # validate signature + claims using the public key named by the token's kid
+    _ring.reload()
+    kid = jwt.get_unverified_header(token).get("kid") or _ring.keys.signer(time.time())[0]
+    pub = _ring.keys.pubs.get(kid)
+    if pub is None:
+        # may have been rotated by another worker since our last poll
+        _ring.reload(force=True)
+        pub = _ring.keys.pubs.get(kid)
+        if pub is None:
+            raise JWTError(f"Unknown kid {kid}")
+    return jwt.decode(token, pub, algorithms=["RS256"], audience=AUDIENCE, issuer=ISSUER)
+
+def role_mask(role_ids: Iterable[int]) -> int:
+    mask = 0
+    for i in role_ids:
+        mask |= 1 << i
+    return mask
 
-def has_role(user_roles: Set[str], required: Set[str]) -> bool:
-    return bool(user_roles & required)
+if __name__ == "__main__":
+    # python security.py rotate
+    if sys.argv[1:] == ["rotate"]:
+        print(rotate_keys())
+    else:
+        sys.exit("usage: python security.py rotate")
@@ -1,14 +1,29 @@
-from typing import Dict, Any, Optional, Set
-from fastapi import FastAPI, Header, HTTPException, status, Depends
+from typing import Dict, Any, Optional
+from fastapi import FastAPI, HTTPException, Request, Depends
 from pydantic import BaseModel, Field
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy import or_
 
 from db import get_db, create_all, apply_bootstrap_migrations, Project
-from atlas_auth import decode_and_validate, has_any_role
+from atlas_auth import AuthMiddleware
+from atlas_auth.responses import FastJSONResponse
+from atlas_auth.logs import setup_logging, AccessLogMiddleware
+from atlas_auth.profiling import ProfilingMiddleware
+
+setup_logging("projects")
+
+# role requirements checked by AuthMiddleware before routing
+ROLE_RULES = [
+    ("POST",   "/projects",        {"admin"}),
+    ("PUT",    "/projects/{code}", {"admin"}),
+    ("DELETE", "/projects/{code}", {"admin"}),
+]
 
 app = FastAPI(title="Projects Service", version="0.4.0")
+app.add_middleware(AuthMiddleware, role_rules=ROLE_RULES)
+app.add_middleware(ProfilingMiddleware)
+app.add_middleware(AccessLogMiddleware)
 
 @app.get("/healthz")
 def healthz():
@@ -27,45 +42,33 @@ class ProjectUpdate(BaseModel):
     name: Optional[str] = Field(default=None, min_length=1, max_length=200)
     description: Optional[str] = None
 
-def require_auth(required_roles: Optional[Set[str]] = None):
-    def _dep(authorization: str = Header(None, alias="Authorization")) -> Dict[str, Any]:
-        if not authorization or not authorization.startswith("Bearer "):
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Missing bearer token")
-        token = authorization.split(" ", 1)[1]
-        try:
-            claims = decode_and_validate(token)
-        except Exception as e:
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=f"Invalid token: {e}")
-        if required_roles and not has_any_role(claims, required_roles):
-            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Insufficient role")
-        return claims
-    return _dep
+def current_claims(request: Request) -> Dict[str, Any]:
+    return request.state.claims
 
 @app.get("/health")
 def health(): return {"ok": True}
 
 @app.get("/me")
-def me(claims: Dict[str, Any] = Depends(require_auth())):
+def me(claims: Dict[str, Any] = Depends(current_claims)):
     return {"sub": claims.get("sub"), "roles": claims.get("roles", [])}
 
-@app.get("/projects")
+@app.get("/projects", response_class=FastJSONResponse)
 def list_projects(
     q: Optional[str] = None,
     limit: int = 50,
     offset: int = 0,
-    claims: Dict[str, Any] = Depends(require_auth()),
     db: Session = Depends(get_db),
 ):
-    query = db.query(Project)
+    query = db.query(Project.id, Project.name, Project.code, Project.description)
     if q:
         like = f"%{q}%"
         query = query.filter(or_(Project.name.ilike(like), Project.code.ilike(like)))
     rows = query.order_by(Project.id.asc()).limit(limit).offset(offset).all()
-    items = [{"id": r.id, "name": r.name, "code": r.code, "description": r.description} for r in rows]
-    return {"items": items, "count": len(items)}
+    items = [r._asdict() for r in rows]
+    return FastJSONResponse({"items": items, "count": len(items)})
 
 @app.get("/projects/{code}")
-def get_project(code: str, claims: Dict[str, Any] = Depends(require_auth()), db: Session = Depends(get_db)):
+def get_project(code: str, db: Session = Depends(get_db)):
     row = db.query(Project).filter(Project.code == code).one_or_none()
     if not row:
         raise HTTPException(status_code=404, detail="Not found")
@@ -74,7 +77,6 @@ def get_project(code: str, claims: Dict[str, Any] = Depends(require_auth()), db:
 @app.post("/projects")
 def create_project(
     body: ProjectIn,
-    claims: Dict[str, Any] = Depends(require_auth(required_roles={"admin"})),
     db: Session = Depends(get_db),
 ):
     try:
@@ -94,7 +96,6 @@ def create_project(
 def update_project(
     code: str,
     body: ProjectUpdate,
-    claims: Dict[str, Any] = Depends(require_auth(required_roles={"admin"})),
     db: Session = Depends(get_db),
 ):
     row = db.query(Project).filter(Project.code == code).one_or_none()
@@ -111,7 +112,6 @@ def update_project(
 @app.delete("/projects/{code}")
 def delete_project(
     code: str,
-    claims: Dict[str, Any] = Depends(require_auth(required_roles={"admin"})),
     db: Session = Depends(get_db),
 ):
     row = db.query(Project).filter(Project.code == code).one_or_none()